@@ -0,0 +1,41 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+class TTLCache:
+    """Простой TTL-кэш в памяти процесса
+
+    Для небольших развертываний заменяет внешний Redis: те же хуки
+    чтения и инвалидации, но без сетевого хопа. Потокобезопасен,
+    вытесняет самые старые записи при переполнении.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 300.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Any, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Any) -> None:
+        with self._lock:
+            self._data.pop(key, None)
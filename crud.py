@@ -1,230 +1,371 @@
-from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import func
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload, load_only
+from sqlalchemy import select, insert, delete, func, case, bindparam, lambda_stmt
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.exc import IntegrityError
 from fastapi import HTTPException, status
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 from models import Operator, Lead, Source, Contact, OperatorSourceWeight
-from schemas import (OperatorCreate, LeadCreate, SourceCreate, 
+from schemas import (OperatorCreate, LeadCreate, SourceCreate,
                     ContactCreate, OperatorSourceWeightCreate)
-from distribution import DistributionEngine, SourceNotFoundError
+from cache import TTLCache
+from distribution import (DistributionEngine, SourceNotFoundError,
+                          bump_config_version, invalidate_source_cache,
+                          note_contact_assigned)
+
+# Колонки, которые реально попадают в Response-схемы — для load_only
+_response_columns = {
+    Operator: ('name', 'is_active', 'max_load', 'created_at'),
+    Lead: ('external_id', 'name', 'email', 'phone', 'created_at'),
+    Source: ('name', 'description', 'created_at'),
+    Contact: ('lead_id', 'source_id', 'operator_id', 'status', 'message', 'created_at'),
+}
+
+def _build_load_chain(parent, model, rel_name: str, nested: dict) -> list:
+    rel = getattr(model, rel_name)
+    target = rel.property.mapper.class_
+
+    loader = parent.selectinload(rel) if parent is not None else selectinload(rel)
+    columns = _response_columns.get(target)
+    if columns:
+        loader = loader.load_only(*[getattr(target, column) for column in columns])
+
+    if not nested:
+        return [loader]
+
+    chains = []
+    for sub_name, sub_nested in nested.items():
+        chains.extend(_build_load_chain(loader, target, sub_name, sub_nested))
+    return chains
+
+def build_loads(model, spec: dict) -> list:
+    """Построить дерево selectinload + load_only по описанию связей
 
-def create_operator(db: Session, operator: OperatorCreate) -> Operator:
-    db_operator = Operator(**operator.dict())
-    
+    spec — вложенный словарь вида {"lead": {}, "contacts": {"operator": {}}}:
+    каждая связь загружается через selectinload, а выборка колонок
+    ограничивается тем, что отдают Response-схемы.
+    """
+    options = []
+    for rel_name, nested in spec.items():
+        options.extend(_build_load_chain(None, model, rel_name, nested))
+    return options
+
+# Деревья загрузки для эндпоинтов со связанными объектами
+_contact_loads = {"lead": {}, "source": {}, "operator": {}}
+_lead_loads = {"contacts": {"operator": {}, "source": {}}}
+
+async def create_operator(db: AsyncSession, operator: OperatorCreate) -> Operator:
     try:
-        db.add(db_operator)
-        db.commit()
-        db.refresh(db_operator)
+        result = await db.execute(
+            insert(Operator).values(**operator.model_dump()).returning(Operator)
+        )
+        db_operator = result.scalar_one()
+        await db.commit()
         return db_operator
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Operator with this name already exists"
         )
 
-def get_operators(db: Session, skip: int = 0, limit: int = 100) -> List[Operator]:
-    return db.query(Operator).offset(skip).limit(limit).all()
+async def get_operators(db: AsyncSession, after_id: Optional[int] = None, limit: int = 100) -> List[Operator]:
+    query = select(Operator).order_by(Operator.id).limit(limit)
+    if after_id is not None:
+        query = query.where(Operator.id > after_id)
+    result = await db.execute(query)
+    return result.scalars().all()
+
+async def get_operators_with_load(db: AsyncSession, after_id: Optional[int] = None, limit: int = 100) -> List[Tuple[Operator, int]]:
+    """Получить операторов вместе с нагрузкой одним запросом"""
+    load = func.coalesce(
+        func.sum(case((Contact.status.in_(["new", "in_progress"]), 1), else_=0)), 0
+    ).label('load')
+
+    query = (
+        select(Operator, load)
+        .outerjoin(Contact, Contact.operator_id == Operator.id)
+        .group_by(Operator.id)
+        .order_by(Operator.id)
+        .limit(limit)
+    )
+    if after_id is not None:
+        query = query.where(Operator.id > after_id)
+
+    result = await db.execute(query)
+    return result.all()
+
+# Кэшируемый стейтмент: карта нагрузок собирается без повторной компиляции
+_load_map_stmt = lambda_stmt(lambda: select(
+    Contact.operator_id,
+    func.count(Contact.id).label('load')
+).where(
+    Contact.operator_id.in_(bindparam('ids', expanding=True)),
+    Contact.status.in_(["new", "in_progress"])
+).group_by(Contact.operator_id))
 
-def get_operators_load_map(db: Session, operator_ids: List[int]) -> Dict[int, int]:
+async def get_operators_load_map(db: AsyncSession, operator_ids: List[int]) -> Dict[int, int]:
     """Получить карту нагрузок для операторов одним запросом"""
     if not operator_ids:
         return {}
-    
-    result = db.query(
-        Contact.operator_id,
-        func.count(Contact.id).label('load')
-    ).filter(
-        Contact.operator_id.in_(operator_ids),
-        Contact.status.in_(["new", "in_progress"])
-    ).group_by(Contact.operator_id).all()
-    
-    return {op_id: load for op_id, load in result}
-
-def create_lead(db: Session, lead: LeadCreate) -> Lead:
-    """Создать лида с защитой от дубликатов"""
-    # Сначала пытаемся найти существующий лид
-    existing_lead = db.query(Lead).filter(Lead.external_id == lead.external_id).first()
-    if existing_lead:
-        # Обновляем существующий лид
-        update_data = lead.dict(exclude_unset=True)
-        for field, value in update_data.items():
-            if field != 'external_id' and value is not None and str(value).strip():
-                setattr(existing_lead, field, value)
-        db.commit()
-        db.refresh(existing_lead)
-        return existing_lead
-    
-    # Создаем новый лид
-    db_lead = Lead(**lead.dict())
-    
-    try:
-        db.add(db_lead)
-        db.commit()
-        db.refresh(db_lead)
-        return db_lead
-    except IntegrityError:
-        db.rollback()
-        # Если произошел конфликт, находим существующий лид
-        existing_lead = db.query(Lead).filter(Lead.external_id == lead.external_id).first()
-        if existing_lead:
-            return existing_lead
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Failed to create lead"
-            )
 
-def get_or_create_lead(db: Session, external_id: str, **kwargs) -> Lead:
+    result = await db.execute(_load_map_stmt, {'ids': operator_ids})
+    return {op_id: load for op_id, load in result.all()}
+
+async def create_lead(db: AsyncSession, lead: LeadCreate) -> Lead:
+    """Создать или обновить лида одним upsert-запросом"""
+    # Обновляем только явно переданные непустые поля
+    update_fields = [
+        field for field, value in lead.model_dump(exclude_unset=True).items()
+        if field != 'external_id' and value is not None and str(value).strip()
+    ]
+
+    stmt = sqlite_insert(Lead).values(**lead.model_dump())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['external_id'],
+        # При пустом наборе полей делаем вырожденный UPDATE, чтобы RETURNING
+        # вернул строку и при конфликте
+        set_={field: stmt.excluded[field] for field in (update_fields or ['external_id'])}
+    ).returning(Lead)
+
+    result = await db.execute(stmt)
+    db_lead = result.scalar_one()
+    await db.commit()
+    return db_lead
+
+async def fast_get_or_create_lead_id(db: AsyncSession, external_id: str) -> int:
+    """Получить id лида по external_id, при необходимости создав его
+
+    Горячий путь create_contact: один upsert без Pydantic-валидации и без
+    загрузки всей строки. Не коммитит — выполняется в транзакции вызывающего.
+    """
+    stmt = sqlite_insert(Lead).values(external_id=external_id)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['external_id'],
+        # Вырожденный UPDATE, чтобы RETURNING вернул строку и при конфликте
+        set_={'external_id': stmt.excluded.external_id}
+    ).returning(Lead.id)
+
+    result = await db.execute(stmt)
+    return result.scalar_one()
+
+async def get_or_create_lead(db: AsyncSession, external_id: str, **kwargs) -> Lead:
     """Найти или создать лида"""
-    # Сначала пытаемся найти существующий лид
-    existing_lead = db.query(Lead).filter(Lead.external_id == external_id).first()
-    if existing_lead:
-        # Обновляем данные если нужно
-        update_data = {k: v for k, v in kwargs.items() if v is not None and str(v).strip()}
-        for field, value in update_data.items():
-            setattr(existing_lead, field, value)
-        db.commit()
-        db.refresh(existing_lead)
-        return existing_lead
-    
-    # Создаем новый лид
     lead_data = {k: v for k, v in kwargs.items() if v is not None and str(v).strip()}
     lead_data['external_id'] = external_id
-    
+
     try:
         lead_create = LeadCreate(**lead_data)
-        return create_lead(db, lead_create)
+        return await create_lead(db, lead_create)
     except Exception:
         # Если не удалось создать с полными данными, создаем с минимальными
         minimal_data = {'external_id': external_id}
         lead_create = LeadCreate(**minimal_data)
-        return create_lead(db, lead_create)
+        return await create_lead(db, lead_create)
 
-def create_source(db: Session, source: SourceCreate) -> Source:
-    db_source = Source(**source.dict())
-    
+async def create_source(db: AsyncSession, source: SourceCreate) -> Source:
     try:
-        db.add(db_source)
-        db.commit()
-        db.refresh(db_source)
+        result = await db.execute(
+            insert(Source).values(**source.model_dump()).returning(Source)
+        )
+        db_source = result.scalar_one()
+        await db.commit()
         return db_source
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Source with this name already exists"
         )
 
-def get_sources(db: Session, skip: int = 0, limit: int = 100) -> List[Source]:
-    return db.query(Source).offset(skip).limit(limit).all()
+async def get_sources(db: AsyncSession, after_id: Optional[int] = None, limit: int = 100) -> List[Source]:
+    query = select(Source).order_by(Source.id).limit(limit)
+    if after_id is not None:
+        query = query.where(Source.id > after_id)
+    result = await db.execute(query)
+    return result.scalars().all()
 
-def set_distribution_config(db: Session, config) -> List[OperatorSourceWeight]:
-    source = db.query(Source).filter(Source.id == config.source_id).first()
+async def set_distribution_config(db: AsyncSession, config) -> List[OperatorSourceWeight]:
+    result = await db.execute(select(Source).where(Source.id == config.source_id))
+    source = result.scalar_one_or_none()
     if not source:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Source not found"
         )
-    
+
     operator_ids = [op.operator_id for op in config.operators]
-    existing_operators = db.query(Operator.id).filter(Operator.id.in_(operator_ids)).all()
-    existing_operator_ids = {op.id for op in existing_operators}
-    
+    result = await db.execute(select(Operator.id).where(Operator.id.in_(operator_ids)))
+    existing_operator_ids = {op_id for op_id, in result.all()}
+
     missing_operators = set(operator_ids) - existing_operator_ids
     if missing_operators:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Operators not found: {missing_operators}"
         )
-    
+
     try:
         # Удаляем старые настройки
-        db.query(OperatorSourceWeight).filter(
-            OperatorSourceWeight.source_id == config.source_id
-        ).delete()
-        
-        # Создаем новые настройки
-        weights = []
-        for op_weight in config.operators:
-            db_weight = OperatorSourceWeight(**op_weight.dict())
-            db.add(db_weight)
-            weights.append(db_weight)
-        
-        db.commit()
-        
-        # Обновляем объекты
-        for weight in weights:
-            db.refresh(weight)
-        
+        await db.execute(
+            delete(OperatorSourceWeight).where(
+                OperatorSourceWeight.source_id == config.source_id
+            )
+        )
+
+        # Вставляем все веса одним запросом и сразу получаем их id
+        result = await db.execute(
+            insert(OperatorSourceWeight)
+            .values([
+                {**op_weight.model_dump(), 'source_id': config.source_id}
+                for op_weight in config.operators
+            ])
+            .returning(OperatorSourceWeight)
+        )
+        weights = result.scalars().all()
+
+        await db.commit()
+
+        # Сбрасываем кэши, завязанные на конфигурацию источника
+        bump_config_version(config.source_id)
+        invalidate_source_cache(config.source_id)
+        _config_cache.delete(config.source_id)
+
         return weights
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to set distribution config: {str(e)}"
         )
 
-def get_distribution_config(db: Session, source_id: int) -> List[OperatorSourceWeight]:
-    return db.query(OperatorSourceWeight).filter(
-        OperatorSourceWeight.source_id == source_id
-    ).all()
+# Конфигурация распределения меняется редко — читаем через кэш
+_config_cache = TTLCache(maxsize=1024, ttl=300.0)
+
+async def get_distribution_config(db: AsyncSession, source_id: int) -> List[OperatorSourceWeight]:
+    weights = _config_cache.get(source_id)
+    if weights is not None:
+        return weights
+
+    result = await db.execute(
+        select(OperatorSourceWeight).where(
+            OperatorSourceWeight.source_id == source_id
+        )
+    )
+    weights = result.scalars().all()
+
+    _config_cache.set(source_id, weights)
+    return weights
 
-def create_contact(db: Session, contact: ContactCreate) -> Contact:
+# TTL LRU-кэш недавних обращений: повторные POST в коротком окне
+# возвращаются из памяти и вообще не доходят до БД
+_dedup_cache: "OrderedDict[bytes, tuple]" = OrderedDict()
+_dedup_lock = threading.Lock()
+DEDUP_TTL = 60.0
+DEDUP_MAXSIZE = 10_000
+
+def _contact_dedup_key(contact: ContactCreate) -> bytes:
+    payload = f"{contact.lead_external_id}\x00{contact.source_id}\x00{contact.message or ''}"
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=16).digest()
+
+def _dedup_get(key: bytes) -> Optional[Contact]:
+    with _dedup_lock:
+        entry = _dedup_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, cached_contact = entry
+        if expires_at < time.monotonic():
+            del _dedup_cache[key]
+            return None
+        _dedup_cache.move_to_end(key)
+        return cached_contact
+
+def _dedup_put(key: bytes, db_contact: Contact) -> None:
+    with _dedup_lock:
+        _dedup_cache[key] = (time.monotonic() + DEDUP_TTL, db_contact)
+        _dedup_cache.move_to_end(key)
+        while len(_dedup_cache) > DEDUP_MAXSIZE:
+            _dedup_cache.popitem(last=False)
+
+async def create_contact(db: AsyncSession, contact: ContactCreate) -> Contact:
     """Создать обращение с распределением оператора"""
+    # Дубликат в окне дедупликации — отдаем закэшированный результат
+    dedup_key = _contact_dedup_key(contact)
+    cached_contact = _dedup_get(dedup_key)
+    if cached_contact is not None:
+        return cached_contact
+
     # Проверяем существование источника
-    source = db.query(Source).filter(Source.id == contact.source_id).first()
+    result = await db.execute(select(Source).where(Source.id == contact.source_id))
+    source = result.scalar_one_or_none()
     if not source:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Source not found"
         )
-    
+
     try:
-        # Находим или создаем лида
-        lead = get_or_create_lead(db, contact.lead_external_id)
-        
+        # Находим или создаем лида одним upsert-запросом
+        lead_id = await fast_get_or_create_lead_id(db, contact.lead_external_id)
+
         # Выбираем оператора
         distribution_engine = DistributionEngine(db)
-        operator = distribution_engine.select_operator(contact.source_id)
-        
+        operator = await distribution_engine.select_operator(contact.source_id)
+
         # Создаем обращение (может быть без оператора)
-        db_contact = Contact(
-            lead_id=lead.id,
-            source_id=contact.source_id,
-            operator_id=operator.id if operator else None,
-            message=contact.message
+        result = await db.execute(
+            insert(Contact).values(
+                lead_id=lead_id,
+                source_id=contact.source_id,
+                operator_id=operator.id if operator else None,
+                message=contact.message
+            ).returning(Contact)
         )
-        
-        db.add(db_contact)
-        db.commit()
-        db.refresh(db_contact)
+        db_contact = result.scalar_one()
+        await db.commit()
+
+        # Пополняем счетчик нагрузки без обращения к БД
+        note_contact_assigned(db_contact.operator_id)
+
+        _dedup_put(dedup_key, db_contact)
+
         return db_contact
-        
+
     except SourceNotFoundError as e:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=str(e)
         )
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Failed to create contact: {str(e)}"
         )
 
-def get_contacts(db: Session, skip: int = 0, limit: int = 100) -> List[Contact]:
-    return db.query(Contact).options(
-        selectinload(Contact.lead),
-        selectinload(Contact.source),
-        selectinload(Contact.operator)
-    ).offset(skip).limit(limit).all()
+async def get_contacts(db: AsyncSession, after_id: Optional[int] = None, limit: int = 100) -> List[Contact]:
+    query = select(Contact).options(
+        *build_loads(Contact, _contact_loads)
+    ).order_by(Contact.id).limit(limit)
+    if after_id is not None:
+        query = query.where(Contact.id > after_id)
+    result = await db.execute(query)
+    return result.scalars().all()
 
-def get_leads_with_contacts(db: Session) -> List[Lead]:
-    return db.query(Lead).options(selectinload(Lead.contacts)).all()
+async def get_leads_with_contacts(db: AsyncSession) -> List[Lead]:
+    result = await db.execute(
+        select(Lead).options(*build_loads(Lead, _lead_loads))
+    )
+    return result.scalars().all()
 
-def get_operator(db: Session, operator_id: int) -> Operator:
-    operator = db.query(Operator).filter(Operator.id == operator_id).first()
+async def get_operator(db: AsyncSession, operator_id: int) -> Operator:
+    result = await db.execute(select(Operator).where(Operator.id == operator_id))
+    operator = result.scalar_one_or_none()
     if not operator:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -232,9 +373,13 @@ def get_operator(db: Session, operator_id: int) -> Operator:
         )
     return operator
 
-def get_operator_load(db: Session, operator_id: int) -> int:
+# Кэшируемый стейтмент нагрузки одного оператора
+_operator_load_stmt = lambda_stmt(lambda: select(func.count(Contact.id)).where(
+    Contact.operator_id == bindparam('operator_id'),
+    Contact.status.in_(["new", "in_progress"])
+))
+
+async def get_operator_load(db: AsyncSession, operator_id: int) -> int:
     """Получить нагрузку конкретного оператора"""
-    return db.query(Contact).filter(
-        Contact.operator_id == operator_id,
-        Contact.status.in_(["new", "in_progress"])
-    ).count()
\ No newline at end of file
+    result = await db.execute(_operator_load_stmt, {'operator_id': operator_id})
+    return result.scalar()
@@ -1,15 +1,36 @@
-from sqlalchemy import create_engine
+import asyncio
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import (create_async_engine, async_sessionmaker,
+                                    async_scoped_session, AsyncSession)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
-SQLITE_DATABASE_URL = "sqlite:///./crm_system.db"
+SQLITE_DATABASE_URL = "sqlite+aiosqlite:///./crm_system.db"
 
-engine = create_engine(
-    SQLITE_DATABASE_URL, 
-    connect_args={"check_same_thread": False},
-    pool_pre_ping=True
+engine = create_async_engine(
+    SQLITE_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=20,
+    max_overflow=10,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    pool_recycle=3600
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+@event.listens_for(engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Включаем WAL, чтобы читатели не блокировались за писателями"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+# Реестр сессий с областью видимости "текущая задача": повторные обращения
+# внутри одного запроса переиспользуют одну и ту же сессию
+SessionLocal = async_scoped_session(
+    async_sessionmaker(engine, expire_on_commit=False, autoflush=False),
+    scopefunc=asyncio.current_task
+)
 
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
@@ -1,8 +1,13 @@
+import bisect
+import itertools
 import random
-from sqlalchemy.orm import Session
-from sqlalchemy import func, case
+import threading
+import time
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, case, bindparam, lambda_stmt
+from cache import TTLCache
 from models import Operator, Contact, OperatorSourceWeight, Source
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 
 class DistributionError(Exception):
     """Базовое исключение для ошибок распределения"""
@@ -12,44 +17,132 @@ class SourceNotFoundError(DistributionError):
     """Источник не найден"""
     pass
 
+# Кэш таблиц Vose по источникам: source_id -> (version, ids, weights, max_loads, probs, alias)
+_alias_cache: Dict[int, tuple] = {}
+_config_version: Dict[int, int] = {}
+_cache_lock = threading.Lock()
+
+def bump_config_version(source_id: int) -> None:
+    """Сбросить кэш распределения после изменения конфигурации источника"""
+    with _cache_lock:
+        _config_version[source_id] = _config_version.get(source_id, 0) + 1
+        _alias_cache.pop(source_id, None)
+
+# Счетчик активной нагрузки операторов в памяти процесса
+_load_counter: Dict[int, int] = {}
+_load_counter_lock = threading.Lock()
+_load_synced_at = 0.0
+
+# Интервал сверки счетчика с БД, секунд
+LOAD_RESYNC_INTERVAL = 30.0
+
+def note_contact_assigned(operator_id: Optional[int]) -> None:
+    """Учесть назначенное обращение в счетчике нагрузки"""
+    if operator_id is None:
+        return
+    with _load_counter_lock:
+        _load_counter[operator_id] = _load_counter.get(operator_id, 0) + 1
+
+def build_alias_table(weights: List[int]) -> Tuple[List[float], List[int]]:
+    """Построить таблицы Vose для O(1) взвешенного выбора"""
+    k = len(weights)
+    total = float(sum(weights))
+    if total <= 0:
+        # Вырожденные веса — равномерный выбор
+        return [1.0] * k, list(range(k))
+
+    probs = [0.0] * k
+    alias = list(range(k))
+    scaled = [w * k / total for w in weights]
+
+    small = [i for i, s in enumerate(scaled) if s < 1.0]
+    large = [i for i, s in enumerate(scaled) if s >= 1.0]
+
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        probs[s] = scaled[s]
+        alias[s] = l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+
+    # Оставшиеся колонки заполнены целиком
+    for i in large:
+        probs[i] = 1.0
+    for i in small:
+        probs[i] = 1.0
+
+    return probs, alias
+
+# Источники меняются редко — кэшируем их на короткий TTL
+_source_cache = TTLCache(maxsize=1024, ttl=300.0)
+
+def invalidate_source_cache(source_id: int) -> None:
+    """Сбросить закэшированный источник"""
+    _source_cache.delete(source_id)
+
+# Кэшируемые стейтменты горячего пути — компилируются один раз
+_source_stmt = lambda_stmt(lambda: select(Source).where(
+    Source.id == bindparam('source_id')
+))
+
+_weights_stmt = lambda_stmt(lambda: select(
+    Operator.id, OperatorSourceWeight.weight, Operator.max_load
+).join(
+    OperatorSourceWeight, Operator.id == OperatorSourceWeight.operator_id
+).where(
+    OperatorSourceWeight.source_id == bindparam('source_id'),
+    Operator.is_active == True
+))
+
 class DistributionEngine:
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         self.db = db
-    
-    def validate_source(self, source_id: int) -> Source:
-        """Проверить существование источника"""
-        source = self.db.query(Source).filter(Source.id == source_id).first()
+
+    async def validate_source(self, source_id: int) -> Source:
+        """Проверить существование источника (со сквозным кэшем)"""
+        source = _source_cache.get(source_id)
+        if source is not None:
+            return source
+
+        result = await self.db.execute(_source_stmt, {'source_id': source_id})
+        source = result.scalar_one_or_none()
         if not source:
             raise SourceNotFoundError(f"Source with id {source_id} not found")
+
+        _source_cache.set(source_id, source)
         return source
-    
-    def get_available_operators(self, source_id: int) -> List[dict]:
+
+    async def get_available_operators(self, source_id: int) -> List[dict]:
         """Получить доступных операторов для источника одним оптимизированным запросом"""
         # Валидируем источник
-        self.validate_source(source_id)
-        
+        await self.validate_source(source_id)
+
         # Подзапрос для подсчета нагрузки по операторам
-        load_subquery = self.db.query(
+        load_subquery = select(
             Contact.operator_id,
             func.count(Contact.id).label('current_load')
-        ).filter(
+        ).where(
             Contact.status.in_(["new", "in_progress"])
         ).group_by(Contact.operator_id).subquery()
-        
+
         # Основной запрос: операторы с весами и нагрузкой
-        operators_data = self.db.query(
-            Operator,
-            OperatorSourceWeight.weight,
-            func.coalesce(load_subquery.c.current_load, 0).label('current_load')
-        ).join(
-            OperatorSourceWeight, Operator.id == OperatorSourceWeight.operator_id
-        ).outerjoin(
-            load_subquery, Operator.id == load_subquery.c.operator_id
-        ).filter(
-            OperatorSourceWeight.source_id == source_id,
-            Operator.is_active == True
-        ).all()
-        
+        result = await self.db.execute(
+            select(
+                Operator,
+                OperatorSourceWeight.weight,
+                func.coalesce(load_subquery.c.current_load, 0).label('current_load')
+            ).join(
+                OperatorSourceWeight, Operator.id == OperatorSourceWeight.operator_id
+            ).outerjoin(
+                load_subquery, Operator.id == load_subquery.c.operator_id
+            ).where(
+                OperatorSourceWeight.source_id == source_id,
+                Operator.is_active == True
+            )
+        )
+        operators_data = result.all()
+
         # Фильтруем операторов по нагрузке
         available_operators = []
         for operator, weight, current_load in operators_data:
@@ -59,13 +152,102 @@ class DistributionEngine:
                     'weight': weight,
                     'current_load': current_load
                 })
-        
+
         return available_operators
-    
-    def select_operator(self, source_id: int) -> Optional[Operator]:
-        """Выбрать оператора по весовому распределению"""
+
+    async def get_alias_table(self, source_id: int) -> tuple:
+        """Получить (или построить) таблицу Vose для источника"""
+        version = _config_version.get(source_id, 0)
+        with _cache_lock:
+            entry = _alias_cache.get(source_id)
+        if entry is not None and entry[0] == version:
+            return entry
+
+        # Промах кэша: забираем веса и лимиты одним запросом
+        result = await self.db.execute(_weights_stmt, {'source_id': source_id})
+        rows = result.all()
+
+        ids = [row[0] for row in rows]
+        weights = [row[1] for row in rows]
+        max_loads = [row[2] for row in rows]
+        probs, alias = build_alias_table(weights) if ids else ([], [])
+
+        entry = (version, ids, weights, max_loads, probs, alias)
+        with _cache_lock:
+            _alias_cache[source_id] = entry
+        return entry
+
+    async def resync_load_counter(self) -> None:
+        """Пересчитать счетчик нагрузки из БД одним запросом"""
+        global _load_synced_at
+
+        result = await self.db.execute(
+            select(
+                Contact.operator_id,
+                func.count(Contact.id).label('current_load')
+            ).where(
+                Contact.operator_id.isnot(None),
+                Contact.status.in_(["new", "in_progress"])
+            ).group_by(Contact.operator_id)
+        )
+        fresh = dict(result.all())
+
+        with _load_counter_lock:
+            _load_counter.clear()
+            _load_counter.update(fresh)
+            _load_synced_at = time.monotonic()
+
+    async def get_loads(self, operator_ids: List[int]) -> Dict[int, int]:
+        """Получить текущую нагрузку операторов из счетчика в памяти
+
+        Счетчик пополняется при создании обращений и периодически
+        сверяется с БД, чтобы скорректировать дрейф.
+        """
+        if time.monotonic() - _load_synced_at > LOAD_RESYNC_INTERVAL:
+            await self.resync_load_counter()
+
+        with _load_counter_lock:
+            return {op_id: _load_counter.get(op_id, 0) for op_id in operator_ids}
+
+    async def _fetch_operator(self, operator_id: int) -> Optional[Operator]:
+        result = await self.db.execute(select(Operator).where(Operator.id == operator_id))
+        return result.scalar_one_or_none()
+
+    async def select_operator(self, source_id: int) -> Optional[Operator]:
+        """Выбрать оператора по весовому распределению за O(1) через таблицу Vose"""
         try:
-            available_operators = self.get_available_operators(source_id)
+            await self.validate_source(source_id)
+
+            _, ids, weights, max_loads, probs, alias = await self.get_alias_table(source_id)
+            if not ids:
+                return None
+
+            k = len(ids)
+            loads = await self.get_loads(ids)
+
+            # O(1)-выбор: два случайных числа на попытку, перегруженных пропускаем
+            for _ in range(2 * k):
+                i = random.randrange(k)
+                if random.random() >= probs[i]:
+                    i = alias[i]
+                if loads.get(ids[i], 0) < max_loads[i]:
+                    return await self._fetch_operator(ids[i])
+
+            # Фолбэк: взвешенный выбор среди доступных операторов через
+            # префиксные суммы + бинарный поиск вместо линейного прохода
+            available = [i for i in range(k) if loads.get(ids[i], 0) < max_loads[i]]
+            if not available:
+                return None
+
+            cum_weights = list(itertools.accumulate(weights[i] for i in available))
+            total_weight = cum_weights[-1]
+            if total_weight <= 0:
+                return await self._fetch_operator(ids[available[0]])
+
+            random_value = random.uniform(0, total_weight)
+            idx = bisect.bisect_left(cum_weights, random_value)
+            idx = min(idx, len(available) - 1)
+            return await self._fetch_operator(ids[available[idx]])
         except SourceNotFoundError:
             # Пробрасываем специфические ошибки
             raise
@@ -73,21 +255,3 @@ class DistributionEngine:
             # Логируем ошибку и возвращаем None
             print(f"Error in select_operator: {e}")
             return None
-        
-        if not available_operators:
-            return None
-        
-        # Взвешенный случайный выбор
-        total_weight = sum(op['weight'] for op in available_operators)
-        if total_weight <= 0:
-            return available_operators[0]['operator']
-        
-        random_value = random.uniform(0, total_weight)
-        current_weight = 0
-        
-        for op_data in available_operators:
-            current_weight += op_data['weight']
-            if random_value <= current_weight:
-                return op_data['operator']
-        
-        return available_operators[0]['operator']
\ No newline at end of file
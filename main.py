@@ -1,23 +1,26 @@
 from fastapi import FastAPI, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
 from database import SessionLocal, engine, Base
-from schemas import (OperatorCreate, OperatorResponse, LeadCreate, LeadResponse, 
+from schemas import (OperatorCreate, OperatorResponse, LeadCreate, LeadResponse,
                     SourceCreate, SourceResponse, ContactCreate, ContactResponse,
-                    DistributionConfig, OperatorSourceWeightResponse, ErrorResponse)
-from crud import (create_operator, get_operators, get_operators_load_map, create_lead, 
+                    DistributionConfig, OperatorSourceWeightResponse, ErrorResponse,
+                    OperatorPage, SourcePage, ContactPage)
+from crud import (create_operator, get_operators_with_load, create_lead,
                  create_source, get_sources, set_distribution_config, get_distribution_config,
-                 create_contact, get_contacts, get_leads_with_contacts, 
+                 create_contact, get_contacts, get_leads_with_contacts,
                  get_operator, get_operator_load)
-
-# Создаем таблицы
-Base.metadata.create_all(bind=engine)
+from distribution import DistributionEngine
+import models
 
 app = FastAPI(
     title="Mini-CRM Lead Distribution System",
     description="Система распределения лидов между операторами по источникам",
     version="9.0.0",
+    default_response_class=ORJSONResponse,
     responses={
         400: {"model": ErrorResponse},
         404: {"model": ErrorResponse},
@@ -25,12 +28,27 @@ app = FastAPI(
     }
 )
 
-def get_db():
+@app.on_event("startup")
+async def init_db():
+    # Создаем таблицы
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # Обновляем статистику планировщика SQLite
+        await conn.execute(text("ANALYZE"))
+
+    # Прогреваем счетчик нагрузки операторов одним запросом
+    db = SessionLocal()
+    try:
+        await DistributionEngine(db).resync_load_counter()
+    finally:
+        await SessionLocal.remove()
+
+async def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
+        await SessionLocal.remove()
 
 # Вспомогательные функции для преобразования
 def operator_to_response(operator, load: int = 0) -> OperatorResponse:
@@ -46,73 +64,73 @@ def operator_to_response(operator, load: int = 0) -> OperatorResponse:
 
 # Операторы
 @app.post("/operators/", response_model=OperatorResponse, status_code=201)
-def create_operator_endpoint(operator: OperatorCreate, db: Session = Depends(get_db)):
-    operator_obj = create_operator(db, operator)
+async def create_operator_endpoint(operator: OperatorCreate, db: AsyncSession = Depends(get_db)):
+    operator_obj = await create_operator(db, operator)
     return operator_to_response(operator_obj, 0)
 
-@app.get("/operators/", response_model=List[OperatorResponse])
-def read_operators(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    operators = get_operators(db, skip=skip, limit=limit)
-    operator_ids = [op.id for op in operators]
-    loads_map = get_operators_load_map(db, operator_ids)
-    
-    return [operator_to_response(op, loads_map.get(op.id, 0)) for op in operators]
+@app.get("/operators/", response_model=OperatorPage)
+async def read_operators(after: Optional[int] = None, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    operators_with_load = await get_operators_with_load(db, after_id=after, limit=limit)
+    items = [operator_to_response(op, load) for op, load in operators_with_load]
+    return OperatorPage(items=items, next_after=items[-1].id if items else None)
 
 @app.get("/operators/{operator_id}", response_model=OperatorResponse)
-def read_operator(operator_id: int, db: Session = Depends(get_db)):
-    operator = get_operator(db, operator_id)
-    load = get_operator_load(db, operator_id)
+async def read_operator(operator_id: int, db: AsyncSession = Depends(get_db)):
+    operator = await get_operator(db, operator_id)
+    load = await get_operator_load(db, operator_id)
     return operator_to_response(operator, load)
 
 # Лиды
 @app.post("/leads/", response_model=LeadResponse, status_code=201)
-def create_lead_endpoint(lead: LeadCreate, db: Session = Depends(get_db)):
-    lead_obj = create_lead(db, lead)
-    return LeadResponse.from_orm(lead_obj)
+async def create_lead_endpoint(lead: LeadCreate, db: AsyncSession = Depends(get_db)):
+    lead_obj = await create_lead(db, lead)
+    return LeadResponse.model_validate(lead_obj)
 
 # Источники
 @app.post("/sources/", response_model=SourceResponse, status_code=201)
-def create_source_endpoint(source: SourceCreate, db: Session = Depends(get_db)):
-    source_obj = create_source(db, source)
-    return SourceResponse.from_orm(source_obj)
+async def create_source_endpoint(source: SourceCreate, db: AsyncSession = Depends(get_db)):
+    source_obj = await create_source(db, source)
+    return SourceResponse.model_validate(source_obj)
 
-@app.get("/sources/", response_model=List[SourceResponse])
-def read_sources(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    sources = get_sources(db, skip=skip, limit=limit)
-    return [SourceResponse.from_orm(source) for source in sources]
+@app.get("/sources/", response_model=SourcePage)
+async def read_sources(after: Optional[int] = None, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    sources = await get_sources(db, after_id=after, limit=limit)
+    items = [SourceResponse.model_validate(source) for source in sources]
+    return SourcePage(items=items, next_after=items[-1].id if items else None)
 
 # Распределение
 @app.post("/distribution/config/", response_model=List[OperatorSourceWeightResponse], status_code=201)
-def set_distribution_config_endpoint(config: DistributionConfig, db: Session = Depends(get_db)):
-    weights = set_distribution_config(db, config)
-    return [OperatorSourceWeightResponse.from_orm(weight) for weight in weights]
+async def set_distribution_config_endpoint(config: DistributionConfig, db: AsyncSession = Depends(get_db)):
+    weights = await set_distribution_config(db, config)
+    return [OperatorSourceWeightResponse.model_validate(weight) for weight in weights]
 
 @app.get("/distribution/config/{source_id}", response_model=List[OperatorSourceWeightResponse])
-def get_distribution_config_endpoint(source_id: int, db: Session = Depends(get_db)):
-    weights = get_distribution_config(db, source_id)
-    return [OperatorSourceWeightResponse.from_orm(weight) for weight in weights]
+async def get_distribution_config_endpoint(source_id: int, db: AsyncSession = Depends(get_db)):
+    weights = await get_distribution_config(db, source_id)
+    return [OperatorSourceWeightResponse.model_validate(weight) for weight in weights]
 
 # Обращения
 @app.post("/contacts/", response_model=ContactResponse, status_code=201)
-def create_contact_endpoint(contact: ContactCreate, db: Session = Depends(get_db)):
-    contact_obj = create_contact(db, contact)
-    return ContactResponse.from_orm(contact_obj)
+async def create_contact_endpoint(contact: ContactCreate, db: AsyncSession = Depends(get_db)):
+    contact_obj = await create_contact(db, contact)
+    return ContactResponse.model_validate(contact_obj)
 
-@app.get("/contacts/", response_model=List[ContactResponse])
-def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    contacts = get_contacts(db, skip=skip, limit=limit)
-    return [ContactResponse.from_orm(contact) for contact in contacts]
+@app.get("/contacts/", response_model=ContactPage)
+async def read_contacts(after: Optional[int] = None, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    contacts = await get_contacts(db, after_id=after, limit=limit)
+    items = [ContactResponse.model_validate(contact) for contact in contacts]
+    return ContactPage(items=items, next_after=items[-1].id if items else None)
 
 @app.get("/leads/with-contacts/", response_model=List[LeadResponse])
-def read_leads_with_contacts(db: Session = Depends(get_db)):
-    leads = get_leads_with_contacts(db)
-    return [LeadResponse.from_orm(lead) for lead in leads]
+async def read_leads_with_contacts(db: AsyncSession = Depends(get_db)):
+    leads = await get_leads_with_contacts(db)
+    return [LeadResponse.model_validate(lead) for lead in leads]
 
 # Система
 @app.get("/")
-def read_root():
+async def read_root():
     return {"message": "Mini-CRM Lead Distribution System"}
 
 @app.get("/health")
-def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+async def health_check():
+    return {"status": "healthy"}
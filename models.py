@@ -1,9 +1,8 @@
 from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
-from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 
-Base = declarative_base()
+from database import Base
 
 class Operator(Base):
     __tablename__ = "operators"
@@ -53,6 +52,8 @@ class OperatorSourceWeight(Base):
 
     __table_args__ = (
         Index('ix_operator_source_unique', 'operator_id', 'source_id', unique=True),
+        # Покрывающий индекс для выборки весов по источнику
+        Index('ix_osw_source_operator', 'source_id', 'operator_id', 'weight'),
     )
 
 class Contact(Base):
@@ -72,4 +73,6 @@ class Contact(Base):
 
     __table_args__ = (
         Index('ix_contact_operator_status', 'operator_id', 'status'),
+        # Для агрегации WHERE status IN (...) GROUP BY operator_id
+        Index('ix_contact_status_operator', 'status', 'operator_id'),
     )
\ No newline at end of file
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import List, Optional
 from datetime import datetime
 
@@ -14,9 +14,8 @@ class OperatorResponse(OperatorBase):
     id: int
     created_at: datetime
     current_load: int = 0
-    
-    class Config:
-        orm_mode = True
+
+    model_config = ConfigDict(from_attributes=True)
 
 class LeadBase(BaseModel):
     external_id: str = Field(..., min_length=1)
@@ -25,36 +24,37 @@ class LeadBase(BaseModel):
     phone: Optional[str] = Field(None, max_length=20)
 
 class LeadCreate(LeadBase):
-    @validator('external_id')
+    @field_validator('external_id')
+    @classmethod
     def external_id_not_empty(cls, v):
         return v.strip()
 
 class LeadResponse(LeadBase):
     id: int
     created_at: datetime
-    
-    class Config:
-        orm_mode = True
+
+    model_config = ConfigDict(from_attributes=True)
 
 class SourceBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
     description: Optional[str] = Field(None, max_length=200)
 
 class SourceCreate(SourceBase):
-    @validator('name')
+    @field_validator('name')
+    @classmethod
     def name_not_empty(cls, v):
         return v.strip()
 
 class SourceResponse(SourceBase):
     id: int
     created_at: datetime
-    
-    class Config:
-        orm_mode = True
+
+    model_config = ConfigDict(from_attributes=True)
 
 class OperatorSourceWeightBase(BaseModel):
     operator_id: int
-    source_id: int
+    # Может не передаваться в DistributionConfig — подставляется из source_id конфига
+    source_id: Optional[int] = None
     weight: int = Field(gt=0, le=1000, default=10)
 
 class OperatorSourceWeightCreate(OperatorSourceWeightBase):
@@ -62,9 +62,8 @@ class OperatorSourceWeightCreate(OperatorSourceWeightBase):
 
 class OperatorSourceWeightResponse(OperatorSourceWeightBase):
     id: int
-    
-    class Config:
-        orm_mode = True
+
+    model_config = ConfigDict(from_attributes=True)
 
 class ContactBase(BaseModel):
     source_id: int
@@ -73,7 +72,8 @@ class ContactBase(BaseModel):
 class ContactCreate(ContactBase):
     lead_external_id: str = Field(..., min_length=1)
 
-    @validator('lead_external_id')
+    @field_validator('lead_external_id')
+    @classmethod
     def lead_external_id_not_empty(cls, v):
         return v.strip()
 
@@ -83,13 +83,24 @@ class ContactResponse(ContactBase):
     operator_id: Optional[int]
     status: str
     created_at: datetime
-    
-    class Config:
-        orm_mode = True
+
+    model_config = ConfigDict(from_attributes=True)
+
+class OperatorPage(BaseModel):
+    items: List[OperatorResponse]
+    next_after: Optional[int] = None
+
+class SourcePage(BaseModel):
+    items: List[SourceResponse]
+    next_after: Optional[int] = None
+
+class ContactPage(BaseModel):
+    items: List[ContactResponse]
+    next_after: Optional[int] = None
 
 class DistributionConfig(BaseModel):
     source_id: int
     operators: List[OperatorSourceWeightCreate]
 
 class ErrorResponse(BaseModel):
-    detail: str
\ No newline at end of file
+    detail: str
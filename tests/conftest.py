@@ -0,0 +1,104 @@
+import os
+import random
+import time
+import uuid
+from types import SimpleNamespace
+
+import pytest
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy import create_engine, delete
+from sqlalchemy.orm import sessionmaker
+
+from models import Operator, Source, OperatorSourceWeight
+
+BASE_URL = "http://localhost:8000"
+
+class TimeoutAdapter(HTTPAdapter):
+    """HTTPAdapter с таймаутом по умолчанию, чтобы зависший сервер не вешал прогон"""
+
+    def __init__(self, *args, default_timeout: float = 5.0, **kwargs):
+        self.default_timeout = default_timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.default_timeout
+        return super().send(request, **kwargs)
+
+@pytest.fixture(scope="session", autouse=True)
+def _seed_random():
+    """Фиксируем seed, чтобы прогоны были воспроизводимыми"""
+    random.seed(os.environ.get("PYTEST_SEED", 0))
+
+@pytest.fixture(scope="session")
+def unique_id():
+    """Генератор уникальных суффиксов для имен тестовых сущностей"""
+    return lambda: uuid.uuid4().hex[:8]
+
+@pytest.fixture(scope="session")
+def http():
+    """Общая HTTP-сессия с пулом соединений на весь прогон тестов"""
+    session = requests.Session()
+    adapter = TimeoutAdapter(pool_connections=16, pool_maxsize=32)
+    session.mount("http://", adapter)
+    yield session
+    session.close()
+
+@pytest.fixture(scope="session", autouse=True)
+def _wait_for_server(http):
+    """Дождаться готовности сервера и прогреть соединения перед тестами"""
+    for delay in (0.2, 0.2, 0.5, 0.5, 1.0, 1.0):
+        try:
+            if http.get(f"{BASE_URL}/health", timeout=1).status_code == 200:
+                break
+        except requests.ConnectionError:
+            pass
+        time.sleep(delay)
+    else:
+        pytest.exit(f"Сервер на {BASE_URL} не поднялся, тесты не запускаем")
+
+    # Прогреваем пул соединений и кэши приложения до первых проверок
+    http.get(f"{BASE_URL}/operators/")
+    http.get(f"{BASE_URL}/sources/")
+
+@pytest.fixture(scope="session")
+def db_session():
+    """Прямое подключение к БД приложения для посева данных мимо HTTP"""
+    engine = create_engine("sqlite:///./crm_system.db")
+    session = sessionmaker(engine)()
+    yield session
+    session.close()
+    engine.dispose()
+
+@pytest.fixture(scope="session")
+def setup_data(db_session):
+    """Базовые тестовые данные: сеются напрямую в БД один раз на прогон"""
+    suffix = uuid.uuid4().hex[:8]
+
+    op1 = Operator(name=f"TestOperator1_{suffix}", max_load=3, is_active=True)
+    op2 = Operator(name=f"TestOperator2_{suffix}", max_load=2, is_active=True)
+    source = Source(name=f"TestSource_{suffix}",
+                    description="Test source for automated testing")
+    db_session.add_all([op1, op2, source])
+    db_session.commit()
+
+    db_session.add_all([
+        OperatorSourceWeight(operator_id=op1.id, source_id=source.id, weight=70),
+        OperatorSourceWeight(operator_id=op2.id, source_id=source.id, weight=30),
+    ])
+    db_session.commit()
+
+    yield SimpleNamespace(
+        operators=[{'id': op1.id, 'name': op1.name, 'max_load': op1.max_load},
+                   {'id': op2.id, 'name': op2.name, 'max_load': op2.max_load}],
+        sources=[{'id': source.id, 'name': source.name}],
+        contacts=[]
+    )
+
+    # В SQLite нет TRUNCATE — подчищаем посеянные строки одним DELETE на таблицу
+    db_session.execute(delete(OperatorSourceWeight).where(
+        OperatorSourceWeight.source_id == source.id))
+    db_session.execute(delete(Source).where(Source.id == source.id))
+    db_session.execute(delete(Operator).where(Operator.id.in_([op1.id, op2.id])))
+    db_session.commit()
@@ -1,67 +1,32 @@
+import orjson
 import pytest
-import requests
 import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
-import random
 
 BASE_URL = "http://localhost:8000"
 
 class TestCRMSystem:
     """Тесты для CRM системы распределения лидов"""
-    
-    @pytest.fixture
-    def setup_data(self):
-        """Фикстура для подготовки тестовых данных"""
-        self.operators = []
-        self.sources = []
-        self.contacts = []
-        
-        op1_response = requests.post(f"{BASE_URL}/operators/", json={
-            "name": f"TestOperator1_{random.randint(1000, 9999)}",
-            "max_load": 3,
-            "is_active": True
-        })
-        op2_response = requests.post(f"{BASE_URL}/operators/", json={
-            "name": f"TestOperator2_{random.randint(1000, 9999)}",
-            "max_load": 2,
-            "is_active": True
-        })
-        
-        self.operators.append(op1_response.json())
-        self.operators.append(op2_response.json())
-        
-        source_response = requests.post(f"{BASE_URL}/sources/", json={
-            "name": f"TestSource_{random.randint(1000, 9999)}",
-            "description": "Test source for automated testing"
-        })
-        self.sources.append(source_response.json())
-    
-        weights_response = requests.post(f"{BASE_URL}/distribution/config/", json={
-            "source_id": self.sources[0]['id'],
-            "operators": [
-                {"operator_id": self.operators[0]['id'], "weight": 70},
-                {"operator_id": self.operators[1]['id'], "weight": 30}
-            ]
-        })
-        
-        yield
 
-    def test_health_check(self):
+    def test_health_check(self, http):
         """Тест проверки здоровья приложения"""
-        response = requests.get(f"{BASE_URL}/health")
+        response = http.get(f"{BASE_URL}/health")
         assert response.status_code == 200
         assert response.json()["status"] == "healthy"
 
-    def test_create_operator(self):
+    @pytest.mark.parametrize("max_load,is_active", [(5, True), (3, True), (2, False)])
+    def test_create_operator(self, http, unique_id, max_load, is_active):
         """Тест создания оператора"""
         operator_data = {
-            "name": f"NewOperator_{random.randint(1000, 9999)}",
-            "max_load": 5,
-            "is_active": True
+            "name": f"NewOperator_{unique_id()}",
+            "max_load": max_load,
+            "is_active": is_active
         }
-        
-        response = requests.post(f"{BASE_URL}/operators/", json=operator_data)
-        
+
+        response = http.post(f"{BASE_URL}/operators/", json=operator_data)
+
         assert response.status_code == 201
         data = response.json()
         assert data["name"] == operator_data["name"]
@@ -69,87 +34,150 @@ class TestCRMSystem:
         assert data["is_active"] == operator_data["is_active"]
         assert "id" in data
 
-    def test_create_duplicate_operator(self):
+    @pytest.mark.xdist_group("operators")
+    def test_create_duplicate_operator(self, http, unique_id):
         """Тест создания дублирующего оператора"""
         operator_data = {
-            "name": f"UniqueOperator_{random.randint(1000, 9999)}",
+            "name": f"UniqueOperator_{unique_id()}",
             "max_load": 5
         }
-        
-        response1 = requests.post(f"{BASE_URL}/operators/", json=operator_data)
+
+        response1 = http.post(f"{BASE_URL}/operators/", json=operator_data)
         assert response1.status_code == 201
-        
-        response2 = requests.post(f"{BASE_URL}/operators/", json=operator_data)
+
+        response2 = http.post(f"{BASE_URL}/operators/", json=operator_data)
         assert response2.status_code == 400
 
-    def test_create_source(self):
+    def test_create_source(self, http, unique_id):
         """Тест создания источника"""
         source_data = {
-            "name": f"NewSource_{random.randint(1000, 9999)}",
+            "name": f"NewSource_{unique_id()}",
             "description": "Test source description"
         }
-        
-        response = requests.post(f"{BASE_URL}/sources/", json=source_data)
-        
+
+        response = http.post(f"{BASE_URL}/sources/", json=source_data)
+
         assert response.status_code == 201
         data = response.json()
         assert data["name"] == source_data["name"]
         assert data["description"] == source_data["description"]
         assert "id" in data
 
-    def test_lead_creation_and_lookup(self):
+    def test_lead_creation_and_lookup(self, http, unique_id):
         """Тест создания и поиска лида"""
         lead_data = {
-            "external_id": f"test_lead_{random.randint(10000, 99999)}@test.com",
+            "external_id": f"test_lead_{unique_id()}@test.com",
             "name": "Test User",
             "email": "test@example.com",
             "phone": "+1234567890"
         }
-        
-        response = requests.post(f"{BASE_URL}/leads/", json=lead_data)
+
+        response = http.post(f"{BASE_URL}/leads/", json=lead_data)
         assert response.status_code == 201
-        
+
         data = response.json()
         assert data["external_id"] == lead_data["external_id"]
         assert data["name"] == lead_data["name"]
-        
+
         updated_lead_data = {
             "external_id": lead_data["external_id"],
             "name": "Updated Test User",
             "phone": "+0987654321"
         }
-        
-        response2 = requests.post(f"{BASE_URL}/leads/", json=updated_lead_data)
+
+        response2 = http.post(f"{BASE_URL}/leads/", json=updated_lead_data)
         assert response2.status_code == 201
         data2 = response2.json()
         assert data2["name"] == "Updated Test User"
         assert data2["phone"] == "+0987654321"
 
 
-    def test_distribution_config(self, setup_data):
+    def test_distribution_config(self, http, setup_data):
         """Тест настройки распределения"""
-        source_id = self.sources[0]['id']
-        
-        response = requests.get(f"{BASE_URL}/distribution/config/{source_id}")
+        source_id = setup_data.sources[0]['id']
+
+        response = http.get(f"{BASE_URL}/distribution/config/{source_id}")
         assert response.status_code == 200
-        
+
         config = response.json()
-        assert len(config) == 2 
-        
+        assert len(config) == 2
+
         weights = {item['operator_id']: item['weight'] for item in config}
-        assert weights[self.operators[0]['id']] == 70
-        assert weights[self.operators[1]['id']] == 30
+        assert weights[setup_data.operators[0]['id']] == 70
+        assert weights[setup_data.operators[1]['id']] == 30
+
+    def test_weighted_distribution(self, http, unique_id):
+        """Тест весового распределения обращений между операторами"""
+        suffix = unique_id()
+
+        op1 = http.post(f"{BASE_URL}/operators/", json={
+            "name": f"WeightedOp1_{suffix}",
+            "max_load": 50,
+            "is_active": True
+        }).json()
+        op2 = http.post(f"{BASE_URL}/operators/", json={
+            "name": f"WeightedOp2_{suffix}",
+            "max_load": 50,
+            "is_active": True
+        }).json()
+        source = http.post(f"{BASE_URL}/sources/", json={
+            "name": f"WeightedSource_{suffix}",
+            "description": "Source for weighted distribution test"
+        }).json()
+
+        config_response = http.post(f"{BASE_URL}/distribution/config/", json={
+            "source_id": source['id'],
+            "operators": [
+                {"operator_id": op1['id'], "weight": 70},
+                {"operator_id": op2['id'], "weight": 30}
+            ]
+        })
+        assert config_response.status_code == 201
 
-    def test_nonexistent_source_contact(self):
+        # Тело запроса сериализуем один раз, в цикле меняется только номер
+        payload_template = orjson.dumps({
+            "lead_external_id": f"weighted_{suffix}___I__@test.com",
+            "source_id": source['id'],
+            "message": "Weighted test message __I__"
+        })
+        json_headers = {"Content-Type": "application/json"}
+
+        def post_one(i: int) -> dict:
+            body = payload_template.replace(b"__I__", str(i).encode())
+            return http.post(f"{BASE_URL}/contacts/",
+                             data=body, headers=json_headers).json()
+
+        # Запросы независимы — раздаем их пулу потоков, чтобы
+        # перекрыть ожидание сети вместо последовательных round-trip
+        with ThreadPoolExecutor(max_workers=10) as ex:
+            results = list(ex.map(post_one, range(20)))
+
+        operator_counts = Counter(contact.get('operator_id') for contact in results)
+
+        assert sum(operator_counts.values()) == 20
+        assert set(operator_counts) <= {op1['id'], op2['id']}
+        # При весах 70/30 первый оператор практически гарантированно получает обращения
+        assert operator_counts[op1['id']] > 0
+
+        # Проверяем, что нагрузка операторов отражает назначенные обращения:
+        # точечные GET /operators/{id} вместо выкачивания всего списка
+        loads = {
+            oid: http.get(f"{BASE_URL}/operators/{oid}").json()['current_load']
+            for oid in (op1['id'], op2['id'])
+        }
+        assert loads[op1['id']] == operator_counts[op1['id']]
+        assert loads[op2['id']] == operator_counts[op2['id']]
+
+    def test_nonexistent_source_contact(self, http):
         """Тест создания обращения с несуществующим источником"""
         contact_data = {
             "lead_external_id": "test@example.com",
             "source_id": 99999,
             "message": "Test message"
         }
-        
-        response = requests.post(f"{BASE_URL}/contacts/", json=contact_data)
+
+        response = http.post(f"{BASE_URL}/contacts/", json=contact_data)
         assert response.status_code == 404
 
 if __name__ == "__main__":
-    pytest.main([__file__, "-v"])
\ No newline at end of file
+    pytest.main([__file__, "-v"])